@@ -0,0 +1,171 @@
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable
+
+
+def select_first(replies: list[str], finished: bool) -> int | None:
+    """Selects the reply that finished first.
+    :param replies: The replies in the order they finished.
+    :param finished: If all requests finished and no further replies will come.
+    :return: The index of the selected reply."""
+    return 0
+
+
+def select_shortest_valid(replies: list[str], finished: bool) -> int | None:
+    """Selects the shortest reply that is not empty, it can only be selected after all requests finished.
+    :param replies: The replies in the order they finished.
+    :param finished: If all requests finished and no further replies will come.
+    :return: The index of the selected reply or None to wait for further replies."""
+    if not finished:
+        return None
+    valid = [index for index, reply in enumerate(replies) if reply and reply.strip()]
+    if not valid:
+        return 0
+    return min(valid, key=lambda index: len(replies[index]))
+
+
+def select_no_error(replies: list[str], finished: bool) -> int | None:
+    """Selects the first reply that does not contain the [FEHLER] marker of the game.
+    :param replies: The replies in the order they finished.
+    :param finished: If all requests finished and no further replies will come.
+    :return: The index of the selected reply or None to wait for further replies."""
+    for index, reply in enumerate(replies):
+        if reply and "[FEHLER]" not in reply:
+            return index
+    return 0 if finished else None
+
+
+SELECTORS: dict[str, Callable[[list[str], bool], int | None]] = {
+    "first": select_first,
+    "shortest": select_shortest_valid,
+    "no_error": select_no_error,
+}
+
+
+# Wraps every function that is run on a daemon thread, e.g. Profiler.wrap_thread to profile the requests
+_thread_wrapper: Callable[[Callable], Callable] | None = None
+
+
+def set_thread_wrapper(wrapper: Callable[[Callable], Callable] | None):
+    """Sets the wrapper of the functions run by submit_daemon.
+    :param wrapper: A function that returns the wrapped function, None to run the functions unwrapped."""
+    global _thread_wrapper
+    _thread_wrapper = wrapper
+
+
+def submit_daemon(function: Callable, *args) -> Future:
+    """Runs a function on a daemon thread, so an abandoned request does not keep the game from exiting.
+    :param function: The function to run.
+    :param args: The arguments of the function.
+    :return: The future of the result."""
+    future = Future()
+    future.set_running_or_notify_cancel()
+    if _thread_wrapper is not None:
+        function = _thread_wrapper(function)
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _select_response(responses: list[dict], selector: Callable[[list[str], bool], int | None],
+                     finished: bool = True) -> dict | None:
+    """Collects the choices of all responses and moves the selected one to the front of its response.
+    :param responses: The finished responses in the order they finished.
+    :param selector: The selector that picks one of the replies.
+    :param finished: If all requests finished and no further responses will come.
+    :return: The response whose first choice is the selected one or None if the selector waits for more."""
+    candidates = []
+    for response in responses:
+        for choice in response["choices"]:
+            candidates.append((response, choice))
+
+    selected = selector([choice["message"]["content"] for _, choice in candidates], finished)
+    if selected is None:
+        return None
+    selected_response, selected_choice = candidates[selected]
+    selected_response["choices"] = [selected_choice] + [choice for choice in selected_response["choices"]
+                                                        if choice is not selected_choice]
+    return selected_response
+
+
+def _fan_out(request: Callable[[str], dict], models: list[str],
+             selector: Callable[[list[str], bool], int | None]) -> dict:
+    """Sends the request to all models at once and returns as soon as the selector accepts a reply,
+    the remaining requests are abandoned.
+    :param request: The function that sends the request for one model.
+    :param models: The models to send the request to.
+    :param selector: The selector that picks one of the replies.
+    :return: The selected response."""
+    pending = {submit_daemon(request, model) for model in models}
+    responses = []
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+            else:
+                responses.append(future.result())
+        if responses and (selected := _select_response(responses, selector, not pending)) is not None:
+            return selected
+    raise error
+
+
+def _hedge(request: Callable[[str], dict], models: list[str], hedge_delay: float,
+           selector: Callable[[list[str], bool], int | None]) -> dict:
+    """Sends the request to the first model and sends another one to the next model every time the
+    hedge delay passes without an answer, the first answer wins and the other requests are abandoned.
+    :param request: The function that sends the request for one model.
+    :param models: The models to rotate through, the same model is used again if there is only one.
+    :param hedge_delay: The seconds to wait before sending another request.
+    :param selector: The selector that picks one of the replies of the winning response.
+    :return: The winning response."""
+    max_requests = max(len(models), 2)
+    pending: set[Future] = set()
+    sent = 0
+    error = None
+    while True:
+        if sent < max_requests:
+            pending.add(submit_daemon(request, models[sent % len(models)]))
+            sent += 1
+        elif not pending:
+            raise error
+
+        done, pending = wait(pending, timeout=hedge_delay if sent < max_requests else None,
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+            else:
+                return _select_response([future.result()], selector)
+
+
+def complete(create: Callable[..., dict], messages: list[dict[str, str]], models: list[str],
+             hedge_delay: float | None = None, samples: int = 1,
+             selector: Callable[[list[str], bool], int | None] = select_first) -> dict:
+    """Requests a chat completion, optionally hedged or fanned out over several models or samples.\n
+    Without a hedge delay the request is sent to every model at once and the first reply the selector
+    accepts is returned, only selectors that compare all replies wait for every request. With a hedge delay another request is only sent if the previous ones
+    took longer than the delay and the first answer wins.
+    :param create: The function that creates a chat completion, e.g. openai.ChatCompletion.create.
+    :param messages: The messages to send to the API.
+    :param models: The names of the models to use.
+    :param hedge_delay: The seconds to wait before sending a hedged request, None to disable hedging.
+    :param samples: The number of replies to request per model.
+    :param selector: The selector that picks one of the replies, see SELECTORS.
+    :return: The response from the API, its first choice is the selected reply.
+    """
+    def request(model_name: str) -> dict:
+        return create(model=model_name, messages=messages, n=samples)
+
+    if hedge_delay is not None:
+        return _hedge(request, models, hedge_delay, selector)
+    if len(models) == 1 and samples == 1:
+        return request(models[0])
+    return _fan_out(request, models, selector)
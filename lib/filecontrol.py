@@ -1,6 +1,7 @@
 import json
 import os
 from prompt import GamePrompt
+from savefile import SaveFile
 class FileControl:
     """
     A class to control the needed files.
@@ -58,4 +59,62 @@ class FileControl:
             output_conv: list[dict] = json.load(file)
         with open(os.path.join(self.save_path, filename + "_hist.json"), "r") as file:
             output_hist: list[str] = json.load(file)
-        return output_conv, output_hist
\ No newline at end of file
+        return output_conv, output_hist
+
+    def save_path_binary(self, filename: str) -> str:
+        """
+        Returns the path of a binary save container.
+        :param filename: The filename of the save without the extension.
+        :return: The path of the .tsav file.
+        """
+        return os.path.join(self.save_path, filename + ".tsav")
+
+    def save_state_binary(self, conversation: list[dict], message_history: list[str], filename: str,
+                          append: bool = False, overwrite: bool = False):
+        """
+        Saves the conversation and history to a binary save container ending with .tsav.\n
+        If append is set an existing container is extended with the messages it does not contain yet,
+        the earlier records are not rewritten.
+        :param conversation: The conversation to be saved.
+        :param message_history: The history to be saved.
+        :param filename: The filename to save the conversation and history to.
+        :param append: If an existing container with the filename should be extended.
+        :param overwrite: If an existing container with the filename should be replaced.
+        :return: None
+        """
+        path = self.save_path_binary(filename)
+        if os.path.exists(path):
+            if overwrite:
+                # Write the new container next to the old one so the old one survives a crash
+                partial_path = self.save_path_binary(filename + ".partial")
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                self.save_state_binary(conversation, message_history, filename + ".partial")
+                os.replace(partial_path, path)
+                return
+            if not append:
+                raise FileExistsError(path)
+            save = SaveFile(path)
+        else:
+            save = SaveFile.create(path)
+        with save:
+            save.append(conversation[save.count(SaveFile.CONVERSATION):], SaveFile.CONVERSATION)
+            save.append(message_history[save.count(SaveFile.HISTORY):], SaveFile.HISTORY)
+
+    def load_state_binary(self, filename: str) -> SaveFile:
+        """
+        Opens a binary save container, the records are only read when they are accessed.
+        :param filename: The filename to load the conversation and history from.
+        :return: The opened SaveFile, it has to be closed by the caller.
+        """
+        return SaveFile(self.save_path_binary(filename))
+
+    def convert_state(self, filename: str) -> str:
+        """
+        Converts a _conv.json and _hist.json save pair to a binary save container.
+        :param filename: The filename of the save pair.
+        :return: The path of the new save container.
+        """
+        conversation, message_history = self.load_state(filename)
+        self.save_state_binary(conversation, message_history, filename)
+        return self.save_path_binary(filename)
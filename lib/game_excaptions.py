@@ -4,3 +4,7 @@ class TerminalLengthException(Exception):
 
 class Continue(Exception):
     pass
+
+
+class SaveFormatException(Exception):
+    pass
@@ -0,0 +1,256 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from statistics import median
+from contextlib import nullcontext
+from datetime import datetime
+
+
+class Profiler:
+    """
+    A class to profile the phases of a game session.\n
+    Every phase gets its own cProfile CPU statistics, a collapsed stack file from a sampling thread that can be
+    read by flame graph tools and its peak memory and retained memory growth by allocation site from tracemalloc.
+    Functions run on worker threads through wrap_thread are profiled as part of the phase they were started in,
+    or of the phase "background" if they were started outside of a phase.
+    If the profiler is disabled the phases are empty context managers.
+    """
+    def __init__(self, enabled: bool = False, output_path: str = "profiles", sample_interval: float = 0.005,
+                 watched_files: tuple[str, ...] = ("prompt.py", "border.py"), traceback_limit: int = 100):
+        """
+        :param enabled: If the phases should be profiled.
+        :param output_path: The folder the results are written to, a subfolder is created for every session.
+        :param sample_interval: The seconds between two stack samples for the collapsed stacks.
+        :param watched_files: The files whose allocation sites are reported separately.
+        :param traceback_limit: The frames tracemalloc stores per allocation, it has to reach the bottom of the
+                                stacks of the worker threads to leave their allocations out of the phases.
+        """
+        self.enabled = enabled
+        self.output_path = os.path.join(output_path, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        self.sample_interval = sample_interval
+        self.watched_files = watched_files
+        self.traceback_limit = traceback_limit
+        self._null_phase = nullcontext()
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._thread_profiles: dict[str, list[cProfile.Profile]] = {}
+        self._thread_phases: dict[int, str] = {}
+        self._thread_local = threading.local()
+        self._lock = threading.Lock()
+        self._calls: Counter = Counter()
+        self._call_times: dict[str, list[float]] = {}
+        self._wall_time: Counter = Counter()
+        self._cpu_time: Counter = Counter()
+        self._allocations: dict[str, Counter] = {}
+        self._peak_memory: Counter = Counter()
+        self._memory_started = 0
+        self._stacks: dict[str, Counter] = {}
+        self._current: str | None = None
+        self._state: tuple | None = None
+        self._main_thread_id = threading.main_thread().ident
+        self._sampler: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Starts tracemalloc and the stack sampling thread if the profiler is enabled.
+        :return: None
+        """
+        if not self.enabled or self._sampler is not None:
+            return
+        tracemalloc.start(self.traceback_limit)
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def phase(self, name: str):
+        """
+        Returns a context manager that profiles the code inside it as the given phase,
+        phases with the same name are added up and phases must not be nested.
+        :param name: The name of the phase.
+        :return: The context manager.
+        """
+        if not self.enabled:
+            return self._null_phase
+        return _Phase(self, name)
+
+    def wrap_thread(self, function):
+        """
+        Wraps a function that is run on a worker thread, so its calls, CPU time and stacks are added to the phase
+        that is running now. A worker started by another worker belongs to the phase of the first one.
+        :param function: The function to be wrapped.
+        :return: The wrapped function.
+        """
+        if not self.enabled:
+            return function
+        name = getattr(self._thread_local, "phase", None) or self._current or "background"
+
+        def run(*args):
+            self._thread_local.phase = name
+            self._thread_phases[threading.get_ident()] = name
+            profile = cProfile.Profile(time.thread_time)
+            try:
+                profile.enable()
+            except ValueError:  # Another profile is already active and profiles every thread (Python 3.12+)
+                profile = None
+            try:
+                return function(*args)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    with self._lock:
+                        self._thread_profiles.setdefault(name, []).append(profile)
+                self._thread_phases.pop(threading.get_ident(), None)
+        return run
+
+    def _sample(self):
+        """Samples the stack of the main thread while a phase is running and the stacks of the worker threads."""
+        while not self._stop.wait(self.sample_interval):
+            threads = dict(self._thread_phases)
+            if self._current is not None:
+                threads[self._main_thread_id] = self._current
+            frames = sys._current_frames()
+            for thread_id, phase in threads.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self._stacks.setdefault(phase, Counter())[";".join(reversed(stack))] += 1
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        """Takes a tracemalloc snapshot without the allocations of the profiler itself and of the worker threads,
+        every allocation of a worker thread has the wrapper of wrap_thread in its traceback."""
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, __file__, all_frames=True),
+                                                          tracemalloc.Filter(False, tracemalloc.__file__)))
+
+    def begin(self, name: str):
+        """
+        Starts profiling a phase, for phases that do not fit into a with block.
+        :param name: The name of the phase.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        snapshot = self._snapshot()
+        profile = self._profiles.setdefault(name, cProfile.Profile(time.thread_time))
+        self._state = (name, profile, snapshot, time.perf_counter(), time.process_time())
+        self._current = name
+        tracemalloc.reset_peak()
+        self._memory_started = tracemalloc.get_traced_memory()[0]
+        profile.enable()
+
+    def end(self):
+        """
+        Stops profiling the current phase and adds up its results.
+        :return: None
+        """
+        if not self.enabled or self._state is None:
+            return
+        name, profile, snapshot, wall_started, cpu_started = self._state
+        profile.disable()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        self._current = None
+        self._state = None
+        wall_time = time.perf_counter() - wall_started
+        self._wall_time[name] += wall_time
+        self._call_times.setdefault(name, []).append(wall_time)
+        self._cpu_time[name] += time.process_time() - cpu_started
+        self._calls[name] += 1
+        # The peak includes the temporary allocations that are freed again before the phase ends
+        self._peak_memory[name] = max(self._peak_memory[name], peak_memory - self._memory_started)
+        allocations = self._allocations.setdefault(name, Counter())
+        for stat in self._snapshot().compare_to(snapshot, "lineno"):
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                allocations[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+
+    def write(self):
+        """
+        Writes the results of all phases to the output folder.\n
+        <phase>.pstats and <phase>.txt contain the CPU statistics, <phase>.collapsed the collapsed stacks
+        and memory.txt the peak memory and the sites with the most retained memory growth of every phase.
+        Worker threads that did not finish yet are left out of the CPU statistics.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.end()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if not self._calls:
+            return
+        os.makedirs(self.output_path, exist_ok=True)
+
+        summary = [f"{'phase':<16}{'calls':>8}{'wall s':>12}{'cpu s':>12}{'threads':>9}"
+                   f"{'min s':>10}{'median s':>10}{'max s':>10}"]
+        with self._lock:
+            thread_profiles = {name: list(profiles) for name, profiles in self._thread_profiles.items()}
+        for name in list(self._profiles) + [name for name in thread_profiles if name not in self._profiles]:
+            profiles = ([self._profiles[name]] if name in self._profiles else []) + thread_profiles.get(name, [])
+            call_times = self._call_times.get(name) or [0.0]
+            # The wall times of the single calls tell a slow call apart from the average
+            summary.append(f"{name:<16}{self._calls[name]:>8}{self._wall_time[name]:>12.4f}"
+                           f"{self._cpu_time[name]:>12.4f}{len(thread_profiles.get(name, [])):>9}"
+                           f"{min(call_times):>10.4f}{median(call_times):>10.4f}{max(call_times):>10.4f}")
+            stats_text = io.StringIO()
+            stats = pstats.Stats(*profiles, stream=stats_text)
+            stats.dump_stats(os.path.join(self.output_path, name + ".pstats"))
+            stats.sort_stats("cumulative").print_stats(30)
+            with open(os.path.join(self.output_path, name + ".txt"), "w") as file:
+                file.write(stats_text.getvalue())
+            with open(os.path.join(self.output_path, name + ".collapsed"), "w") as file:
+                for stack, samples in self._stacks.get(name, Counter()).items():
+                    file.write(f"{stack} {samples}\n")
+
+        allocation_lines = []
+        for name, allocations in self._allocations.items():
+            allocation_lines.append(f"== {name} ==")
+            # tracemalloc does not know threads, the peak includes the worker threads running during the phase
+            allocation_lines.append(f"peak above the start of the phase (including worker threads): "
+                                    f"{self._peak_memory[name]} B")
+            allocation_lines.append("retained memory growth by allocation site:")
+            for site, size in allocations.most_common(10):
+                allocation_lines.append(f"{size:>12} B  {site}")
+            for watched_file in self.watched_files:
+                allocation_lines.append(f"-- {watched_file} --")
+                watched = Counter({site: size for site, size in allocations.items()
+                                   if os.path.basename(site.rsplit(":", 1)[0]) == watched_file})
+                for site, size in watched.most_common(5):
+                    allocation_lines.append(f"{size:>12} B  {site}")
+            allocation_lines.append("")
+
+        with open(os.path.join(self.output_path, "summary.txt"), "w") as file:
+            file.write("\n".join(summary) + "\n")
+        with open(os.path.join(self.output_path, "memory.txt"), "w") as file:
+            file.write("\n".join(allocation_lines))
+        tracemalloc.stop()
+        print(f"Profile written to {self.output_path}")
+
+
+class _Phase:
+    """
+    The context manager of an enabled profiler phase.
+    """
+    def __init__(self, profiler: Profiler, name: str):
+        """
+        :param profiler: The profiler the phase belongs to.
+        :param name: The name of the phase.
+        """
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.begin(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.end()
@@ -0,0 +1,227 @@
+import json
+import mmap
+import os
+import struct
+from game_excaptions import SaveFormatException
+
+
+class SaveFile:
+    """
+    A class to read and append game saves in a memory mapped binary container.\n
+    The file starts with a header followed by length prefixed records, every stream (the conversation with
+    the API and the printed history) has a chain of fixed width offset tables so reading a record by its
+    index is O(1) and appending a record never rewrites the bytes of earlier records.
+    """
+    MAGIC = b"TASAVE\x00\x00"
+    VERSION = 1
+    CONVERSATION = 0
+    HISTORY = 1
+    # magic, version, reserved, block capacity and the count and first offset table of both streams
+    _HEADER = struct.Struct("<8sHHI" + "QQ" * 2)
+    _OFFSET = struct.Struct("<Q")
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, path: str):
+        """
+        Opens an existing save container.
+        :param path: The path to the save container.
+        """
+        self.path = path
+        self._file = open(path, "r+b")
+        self._map = None
+        self._blocks: list[list[int]] = [[], []]
+        try:
+            self._remap()
+            magic, version, _, self.block_capacity, *streams = self._HEADER.unpack_from(self._map, 0)
+        except (ValueError, struct.error):
+            self.close()
+            raise SaveFormatException(f"{path} is not a save container.")
+        if magic != self.MAGIC or version != self.VERSION or self.block_capacity == 0:
+            self.close()
+            raise SaveFormatException(f"{path} is not a save container of version {self.VERSION}.")
+        self._counts = [streams[0], streams[2]]
+        try:
+            # Every record needs at least its length prefix, larger counts can only come from a damaged header
+            if any(count * self._LENGTH.size > len(self._map) for count in self._counts):
+                raise SaveFormatException(f"{path} has more records than fit into the file.")
+            for stream, first_block in enumerate((streams[1], streams[3])):
+                self._load_blocks(stream, first_block)
+        except SaveFormatException:
+            self.close()
+            raise
+
+    @classmethod
+    def create(cls, path: str, block_capacity: int = 128) -> "SaveFile":
+        """
+        Creates a new empty save container and opens it.
+        :param path: The path of the new save container.
+        :param block_capacity: The number of offsets in each offset table.
+        :return: The opened save container.
+        """
+        with open(path, "xb") as file:
+            file.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, 0, block_capacity, 0, 0, 0, 0))
+        return cls(path)
+
+    def _remap(self):
+        """Maps the current content of the file into memory."""
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _block_size(self) -> int:
+        """Returns the size of an offset table in bytes, the first offset links to the next table."""
+        return self._OFFSET.size * (self.block_capacity + 1)
+
+    def _load_blocks(self, stream: int, block: int):
+        """Follows the chain of offset tables of a stream and remembers their positions,
+        tables are only appended at the end so every table has to start after the previous one."""
+        needed_blocks = -(-self._counts[stream] // self.block_capacity)
+        previous = self._HEADER.size - 1
+        while block and len(self._blocks[stream]) < needed_blocks:
+            if block <= previous:
+                raise SaveFormatException(f"{self.path} has an offset table that links back.")
+            if block + self._block_size() > len(self._map):
+                raise SaveFormatException(f"{self.path} has an offset table outside of the file.")
+            previous = block
+            self._blocks[stream].append(block)
+            block = self._OFFSET.unpack_from(self._map, block)[0]
+        if len(self._blocks[stream]) < needed_blocks:
+            raise SaveFormatException(f"{self.path} is missing offset tables.")
+
+    def count(self, stream: int = CONVERSATION) -> int:
+        """
+        Returns the number of records in a stream.
+        :param stream: SaveFile.CONVERSATION or SaveFile.HISTORY.
+        :return: The number of records.
+        """
+        return self._counts[stream]
+
+    def read(self, index: int, stream: int = CONVERSATION):
+        """
+        Reads a single record of a stream.
+        :param index: The index of the record, negative indices count from the end.
+        :param stream: SaveFile.CONVERSATION or SaveFile.HISTORY.
+        :return: The message dict for the conversation or the printed string for the history.
+        """
+        if index < 0:
+            index += self._counts[stream]
+        if not 0 <= index < self._counts[stream]:
+            raise IndexError("Record index out of range.")
+        block, slot = divmod(index, self.block_capacity)
+        offset = self._OFFSET.unpack_from(self._map, self._blocks[stream][block] + self._OFFSET.size * (slot + 1))[0]
+        try:
+            length = self._LENGTH.unpack_from(self._map, offset)[0]
+        except struct.error:
+            raise SaveFormatException(f"{self.path} has a record outside of the file.")
+        start = offset + self._LENGTH.size
+        if start + length > len(self._map):
+            raise SaveFormatException(f"{self.path} has a record outside of the file.")
+        try:
+            return json.loads(self._map[start:start + length].decode("utf-8"))
+        except ValueError:  # UnicodeDecodeError and JSONDecodeError of a damaged record
+            raise SaveFormatException(f"{self.path} has a damaged record.")
+
+    def last(self, amount: int, stream: int = CONVERSATION) -> list:
+        """
+        Reads the last records of a stream.
+        :param amount: The number of records to read.
+        :param stream: SaveFile.CONVERSATION or SaveFile.HISTORY.
+        :return: The records in their original order.
+        """
+        start = max(self._counts[stream] - amount, 0)
+        return [self.read(index, stream) for index in range(start, self._counts[stream])]
+
+    def iter(self, stream: int = CONVERSATION):
+        """
+        Iterates over all records of a stream without loading them all at once.
+        :param stream: SaveFile.CONVERSATION or SaveFile.HISTORY.
+        :return: An iterator over the records.
+        """
+        for index in range(self._counts[stream]):
+            yield self.read(index, stream)
+
+    def append(self, records: list, stream: int = CONVERSATION):
+        """
+        Appends records to the end of a stream, the header is written last
+        so an interrupted append leaves the earlier records readable.
+        :param records: The message dicts for the conversation or the printed strings for the history.
+        :param stream: SaveFile.CONVERSATION or SaveFile.HISTORY.
+        :return: None
+        """
+        if not records:
+            return
+        count = self._counts[stream]
+        for record in records:
+            self._file.seek(0, os.SEEK_END)
+            block, slot = divmod(count, self.block_capacity)
+            if block == len(self._blocks[stream]):
+                # Start a new offset table and link it from the previous one
+                new_block = self._file.tell()
+                self._file.write(bytes(self._block_size()))
+                if self._blocks[stream]:
+                    self._file.seek(self._blocks[stream][-1])
+                    self._file.write(self._OFFSET.pack(new_block))
+                self._blocks[stream].append(new_block)
+                self._file.seek(0, os.SEEK_END)
+
+            payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            offset = self._file.tell()
+            self._file.write(self._LENGTH.pack(len(payload)) + payload)
+            self._file.seek(self._blocks[stream][block] + self._OFFSET.size * (slot + 1))
+            self._file.write(self._OFFSET.pack(offset))
+            count += 1
+
+        self._file.flush()
+        self._counts[stream] = count
+        self._write_header()
+        self._remap()
+
+    def _write_header(self):
+        """Writes the counts and offset table positions to the header."""
+        first_blocks = [blocks[0] if blocks else 0 for blocks in self._blocks]
+        self._file.seek(0)
+        self._file.write(self._HEADER.pack(self.MAGIC, self.VERSION, 0, self.block_capacity,
+                                           self._counts[0], first_blocks[0], self._counts[1], first_blocks[1]))
+        self._file.flush()
+
+    def compact_size(self) -> int:
+        """
+        Returns the size the file would have if it was written again with the same records,
+        it is smaller than the file if an append was interrupted.
+        :return: The size in bytes.
+        """
+        size = self._HEADER.size + self._block_size() * sum(len(blocks) for blocks in self._blocks)
+        for stream, count in enumerate(self._counts):
+            for index in range(count):
+                block, slot = divmod(index, self.block_capacity)
+                offset = self._OFFSET.unpack_from(self._map, self._blocks[stream][block] + self._OFFSET.size * (slot + 1))[0]
+                size += self._LENGTH.size + self._LENGTH.unpack_from(self._map, offset)[0]
+        return size
+
+    def conversation(self) -> list[dict]:
+        """Returns the whole conversation with the API."""
+        return list(self.iter(self.CONVERSATION))
+
+    def history(self) -> list[str]:
+        """Returns the whole printed history."""
+        return list(self.iter(self.HISTORY))
+
+    def close(self):
+        """Closes the memory map and the file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __len__(self):
+        """
+        Returns the number of messages in the conversation.
+        :return: Length of the conversation.
+        """
+        return self._counts[self.CONVERSATION]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,123 @@
+import re
+import threading
+from concurrent.futures import Future, wait
+from typing import Callable
+from completion import submit_daemon
+
+SUGGESTION_PROMPT = ("List {count} short actions the player could plausibly send next, one per line, "
+                     "without numbering or explanations. Answer in the language of the game.")
+
+
+class Speculator:
+    """
+    A class to generate suggested next actions in the background and to pre-generate the reply of the game
+    to every suggestion while the player reads, the tokens of replies that are not used are counted as wasted.\n
+    Every request runs on its own daemon thread, so requests of a cancelled speculation neither delay the
+    next one nor keep the game from exiting.
+    """
+    def __init__(self, request: Callable[[list[dict[str, str]]], dict], suggestion_count: int = 3):
+        """
+        :param request: The function that sends the messages to the API and returns the response.
+        :param suggestion_count: The number of suggestions to generate.
+        """
+        self.request = request
+        self.suggestion_count = suggestion_count
+        self.suggestions: list[str] = []
+        self.spent_tokens = 0
+        self.used_tokens = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._suggestion_future: Future | None = None
+        self._reply_futures: list[Future] = []
+
+    @property
+    def wasted_tokens(self) -> int:
+        """Returns the tokens of speculative requests whose result was not used."""
+        return self.spent_tokens - self.used_tokens
+
+    def start(self, messages: list[dict[str, str]]):
+        """
+        Cancels the previous speculation and starts generating suggestions for the messages.
+        :param messages: The messages that were sent to the API including its reply.
+        :return: None
+        """
+        self.cancel()
+        with self._lock:
+            self._generation += 1
+            self._suggestion_future = submit_daemon(self._suggest, messages, self._generation)
+
+    def _suggest(self, messages: list[dict[str, str]], generation: int) -> list[str]:
+        """Requests the suggestions and submits the pre-generation of their replies."""
+        response = self.request(messages + [{"role": "user",
+                                             "content": SUGGESTION_PROMPT.format(count=self.suggestion_count)}])
+        self._account(response)
+        suggestions = []
+        for line in (response["choices"][0]["message"]["content"] or "").splitlines():
+            # Remove numbering or bullet points the model added anyway
+            if line := re.sub(r"^\s*(\d+[.)]|[-*•])\s*", "", line).strip():
+                suggestions.append(line)
+        suggestions = suggestions[:self.suggestion_count]
+
+        with self._lock:
+            if generation != self._generation:
+                return []
+            self.suggestions = suggestions
+            for suggestion in suggestions:
+                future = submit_daemon(self.request, messages + [{"role": "user", "content": suggestion}])
+                future.add_done_callback(self._account_future)
+                self._reply_futures.append(future)
+        return suggestions
+
+    def _account(self, response: dict):
+        """Adds the tokens of a speculative response to the spent tokens."""
+        with self._lock:
+            self.spent_tokens += response.get("usage", {}).get("total_tokens", 0)
+
+    def _account_future(self, future: Future):
+        """Adds the tokens of a finished speculative reply to the spent tokens."""
+        if not future.cancelled() and future.exception() is None:
+            self._account(future.result())
+
+    def wait_suggestions(self, timeout: float | None) -> list[str]:
+        """
+        Waits for the suggestions of the current speculation.
+        :param timeout: The maximum seconds to wait, 0 only checks if they are ready, None waits until they are.
+        :return: The suggestions, empty if they are not ready in time or failed.
+        """
+        if self._suggestion_future is None:
+            return []
+        done, _ = wait([self._suggestion_future], timeout=timeout)
+        if not done or self._suggestion_future.exception() is not None:
+            return []
+        return self._suggestion_future.result()
+
+    def take(self, index: int) -> tuple[str, Future]:
+        """
+        Picks a suggestion and cancels the speculation for the other ones.
+        :param index: The index of the suggestion.
+        :return: The suggestion and the future of its pre-generated reply.
+        """
+        with self._lock:
+            suggestion = self.suggestions[index]
+            future = self._reply_futures.pop(index)
+        self.cancel()
+        future.add_done_callback(self._use_future)
+        return suggestion, future
+
+    def _use_future(self, future: Future):
+        """Moves the tokens of a used reply from wasted to used."""
+        if not future.cancelled() and future.exception() is None:
+            with self._lock:
+                self.used_tokens += future.result().get("usage", {}).get("total_tokens", 0)
+
+    def cancel(self):
+        """
+        Cancels the current speculation, its results are discarded and no further replies are requested,
+        replies that are already requested can not be interrupted and are still counted when they finish.
+        :return: None
+        """
+        with self._lock:
+            self._generation += 1
+            self._suggestion_future = None
+            self._reply_futures = []
+            self.suggestions = []
@@ -0,0 +1,47 @@
+from border import Border
+from prompt import GamePrompt
+from BColors import BColors
+
+
+class TurnDisplay:
+    """
+    A class to render the boxes around the actions of the player and the replies of the game.
+    """
+    def __init__(self, column_length: int):
+        """
+        :param column_length: The column length of the boxes.
+        """
+        self.column_length = column_length
+        self.border: Border = Border(["╔", "╗"], ["╚", "╝"], "║", "═", column_length)
+        # Upper border for User actions in game
+        self.text_you = self.border.en_c_up(BColors.HEADER + BColors.BOLD + ' Your Action ' + BColors.ENDC,
+                                            add_len=13)
+        # Upper border for AI actions in game
+        self.text_answer = self.border.en_c_up(BColors.HEADER + BColors.BOLD + ' Game ' + BColors.ENDC, add_len=13)
+        # Vertical border for empty lines
+        self.empty_vert = self.border.en_vert(" ")
+        # GamePrompt object for easy conversion
+        self.display_class: GamePrompt = GamePrompt()
+
+    def render(self, text: str, role: str) -> str:
+        """
+        Wraps a message in a box with the header of its role.
+        :param text: The text of the message.
+        :param role: "user" for an action of the player, every other role is rendered as a reply of the game.
+        :return: The rendered box.
+        """
+        self.display_class.set_from_string(text)
+        # Wrap the display in vertical borders
+        display = self.border.en_wrap(self.display_class.list_string_break(self.column_length, False),
+                                      add_len={0: 0})
+        text_header = self.text_you if role == "user" else self.text_answer
+        return f"{text_header}\n{self.empty_vert}\n{display}\n{self.empty_vert}\n{self.border.en_c_down('')}"
+
+    def render_history(self, conversation: list[dict]) -> list[str]:
+        """
+        Renders the printed history of a conversation, the system prompt is not printed.
+        :param conversation: The conversation to be rendered.
+        :return: The rendered boxes.
+        """
+        return [self.render(message["content"], message["role"]) for message in conversation
+                if message["role"] != "system"]
@@ -7,19 +7,36 @@
 import sys
 sys.path.insert(1, './lib')
 
-import openai
 import os
+import atexit
+from profiler import Profiler
+
+# Profile every phase of the session if the game was launched with --profile, the imports are the first phase
+profiler = Profiler(__name__ == "__main__" and "--profile" in sys.argv[1:],
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+profiler.start()
+atexit.register(profiler.write)
+profiler.begin("imports")
+
+import openai
 import json
 import locale
 from dotenv import load_dotenv
 from filecontrol import FileControl
 from prompt import GamePrompt
 from mbar import mbar_construct
-from game_excaptions import TerminalLengthException, Continue
-from border import Border
+from game_excaptions import TerminalLengthException, Continue, SaveFormatException
+from turn_display import TurnDisplay
 from terminal_len import get_column_length, get_line_length
 from line_del import del_last_line, clear_terminal
 from BColors import BColors
+from completion import complete, select_first, set_thread_wrapper, SELECTORS
+from speculate import Speculator
+
+profiler.end()
+# Profile the requests on the worker threads of hedging, fan-out and speculation as well
+if profiler.enabled:
+    set_thread_wrapper(profiler.wrap_thread)
 
 
 def get_line_space(text: str, term_column_length: int, text_space_offset: int = 0) -> int:
@@ -37,25 +54,64 @@ def get_line_space(text: str, term_column_length: int, text_space_offset: int =
         return complete_lines
 
 
-def communicate_with_ai(messages_to_send: list[dict[str, str]], model_name: str) -> dict:
+def communicate_with_ai(messages_to_send: list[dict[str, str]], model_name: str | list[str],
+                        hedge_delay: float | None = None, samples: int = 1, selector=select_first) -> dict:
     """Communicates with the ChatGPT API and returns the response.
     :param messages_to_send: The messages to send to the API.
-    :param model_name: The name of the model to use.
+    :param model_name: The name of the model to use or a list of models to fan out or hedge over.
+    :param hedge_delay: The seconds to wait before sending a hedged request, None to disable hedging.
+    :param samples: The number of replies to request per model.
+    :param selector: The selector that picks one of the replies, see completion.SELECTORS.
     :return: The response from the API.
     """
-
-    communicate_with_ai_response = openai.ChatCompletion.create(
-        model=model_name,
-        messages=messages_to_send
+    if isinstance(model_name, str):
+        model_name = [model_name]
+
+    communicate_with_ai_response = complete(
+        openai.ChatCompletion.create,
+        messages_to_send,
+        model_name,
+        hedge_delay=hedge_delay,
+        samples=samples,
+        selector=selector
     )
 
     return communicate_with_ai_response
 
 
 if __name__ == "__main__":
+    profiler.begin("startup")
+
     # Load the API key from the .env file
     load_dotenv()
     openai.api_key = os.getenv("API_KEY")
+    # Load the completion settings from the .env file
+    ai_models = [model.strip() for model in os.getenv("AI_MODELS", "gpt-3.5-turbo").split(",") if model.strip()]
+    try:
+        ai_hedge_delay = float(ai_hedge_delay) if (ai_hedge_delay := os.getenv("AI_HEDGE_DELAY")) else None
+        ai_samples = int(os.getenv("AI_SAMPLES", "1"))
+        if ai_samples < 1 or (ai_hedge_delay is not None and ai_hedge_delay < 0):
+            raise ValueError
+    except ValueError:
+        print(BColors.FAIL + "Error: AI_HEDGE_DELAY must be a number of seconds and\n"
+                             "       AI_SAMPLES a whole number greater than 0 in the .env file." + BColors.ENDC)
+        exit(1)
+    if (ai_selector_name := os.getenv("AI_SELECTOR", "first")) not in SELECTORS:
+        print(BColors.FAIL + f"Error: Unknown AI_SELECTOR {ai_selector_name} in the .env file,\n"
+                             f"       valid choices are: {', '.join(SELECTORS)}" + BColors.ENDC)
+        exit(1)
+    ai_selector = SELECTORS[ai_selector_name]
+    if not ai_models:
+        ai_models = ["gpt-3.5-turbo"]
+    try:
+        ai_suggestions = int(os.getenv("AI_SUGGESTIONS", "0"))
+        ai_suggestion_wait = float(os.getenv("AI_SUGGESTION_WAIT", "2"))
+        if ai_suggestions < 0 or ai_suggestion_wait < 0:
+            raise ValueError
+    except ValueError:
+        print(BColors.FAIL + "Error: AI_SUGGESTIONS must be a whole number and\n"
+                             "       AI_SUGGESTION_WAIT a number of seconds in the .env file." + BColors.ENDC)
+        exit(1)
 
     # Create the paths to the prompt and save folders
     app_path = os.path.dirname(os.path.abspath(__file__))
@@ -110,7 +166,10 @@ if __name__ == "__main__":
         else:
             exit(1)
 
+    profiler.end()
+
     # Prompt editing menu
+    profiler.begin("prompt_menu")
     try:  # Ends the loop if the user chooses to continue
         clear_terminal()
         while True:  # Loop for the prompt editing menu
@@ -196,73 +255,116 @@ if __name__ == "__main__":
         clear_terminal()
         print("\nContinuing...\n")
         pass
+    profiler.end()
 
     # Loading a save from a file
     print("\nDo you want to load a Save from a file? Y/N")
     user_input = input("Your choice: ")
     history = None
     conversation: list[dict] = []
+    loaded_name: str | None = None
     while True:
         match user_input:
             case "Y" | "y" | "J" | "j":
-                user_load_input = input("\nEnter the filename without the _hist/_conv.json: ")
+                user_load_input = input("\nEnter the filename without the .tsav or _hist/_conv.json: ")
                 try:
-                    conversation, history = files.load_state(user_load_input)
+                    # Prefer the binary save container over the old json files
+                    with profiler.phase("save_load"):
+                        if os.path.exists(files.save_path_binary(user_load_input)):
+                            with files.load_state_binary(user_load_input) as loaded_save:
+                                conversation = loaded_save.conversation()
+                                history = loaded_save.history()
+                        else:
+                            conversation, history = files.load_state(user_load_input)
+                    loaded_name = user_load_input
                     break
                 except FileNotFoundError:
                     print("File not found.")
                     continue
+                except SaveFormatException:
+                    print("Invalid file.")
+                    continue
             case "N" | "n":
                 break
             case _:
                 print("Invalid input.")
 
-    # Set up Border objects and variables
-    border: Border = Border(["╔", "╗"], ["╚", "╝"], "║", "═", term_column_length)
+    # Set up the boxes around the turns and variables
+    turn_display: TurnDisplay = TurnDisplay(term_column_length)
     enter_action = "Enter in your Action: "
-    # Upper border for User actions in game
-    text_you = BColors.HEADER + BColors.BOLD + ' Your Action ' + BColors.ENDC
-    text_you = border.en_c_up(text_you, add_len=13)
-    # Upper border for AI actions in game
-    text_answer = BColors.HEADER + BColors.BOLD + ' Game ' + BColors.ENDC
-    text_answer = border.en_c_up(text_answer, add_len=13)
-    # Vertical border for empty lines
-    empty_vert = border.en_vert(" ")
-
-    # Set up GamePrompt objects and variables for easy conversion
-    action_display_class: GamePrompt = GamePrompt()
-    action_display: str = ""
-    game_display_class: GamePrompt = GamePrompt()
-    game_display: str = ""
 
     # Create the conversation log variables
     conv_log: list[str] = []
 
-    # Print the history if there is any loaded in
-    if history is not None:
-        for hist_message in history:
-            print(hist_message)
+    # Print the history if there is any loaded in and keep it in the conversation log
+    with profiler.phase("save_load"):
+        if history is not None:
+            for hist_message in history:
+                print(hist_message)
+                conv_log.append(hist_message)
+
+    # Set up the speculative generation of suggested actions if it is enabled
+    speculator: Speculator | None = None
+    if ai_suggestions > 0:
+        speculator = Speculator(lambda speculative_messages: communicate_with_ai(
+            speculative_messages, model_name=ai_models, hedge_delay=ai_hedge_delay,
+            samples=ai_samples, selector=ai_selector), ai_suggestions)
+        if len(conversation) > 0:
+            speculator.start([{"role": "system", "content": str(system_message)}] + conversation)
 
     # Conversation loop
     while True:
+        speculative_response = None
 
         # User Action
         if len(conversation) > 0:  # If the Ai has already replied once
-            user_input = input(enter_action)
+            # Print the suggested actions as #1, #2, ... shortcuts if they are ready, # waits for them
+            suggestion_lines: list[str] = []
+            suggestion_wait: float | None = ai_suggestion_wait
+            lines_to_delete = 0
+            while True:
+                if speculator is not None and not suggestion_lines:
+                    suggestion_lines = [f"{BColors.OKCYAN}#{snum} {suggestion}{BColors.ENDC}" for snum, suggestion
+                                        in enumerate(speculator.wait_suggestions(suggestion_wait), start=1)]
+                    if not suggestion_lines and suggestion_wait is None:
+                        print("No suggestions available.")
+                        lines_to_delete += 1
+                    elif not suggestion_lines:
+                        # Tell the player how to get the suggestions that are still being generated
+                        print(BColors.OKCYAN + "Enter # for suggestions." + BColors.ENDC)
+                        lines_to_delete += 1
+                    for suggestion_line in suggestion_lines:
+                        print(suggestion_line)
+                        lines_to_delete += get_line_space(suggestion_line, term_column_length,
+                                                          -len(BColors.OKCYAN + BColors.ENDC))
+
+                user_input = input(enter_action)
+                lines_to_delete += get_line_space(user_input + enter_action, term_column_length)
+                if speculator is None or user_input != "#":
+                    break
+                # The player asked for the suggestions, wait until they are ready
+                suggestion_wait = None
+
             # Exit the conversation loop if the user enters [EXIT]
             if user_input == "[EXIT]":
+                if speculator is not None:
+                    speculator.cancel()
                 break
-            # Calculate the number of line the user entered and delete those lines
-            del_last_line(loops=get_line_space(user_input + enter_action, term_column_length))
-
-            # Set the user input as the action display
-            action_display_class.set_from_string(user_input)
-            # Wrap the action display in vertical borders
-            action_display = border.en_wrap(action_display_class.list_string_break
-                                            (term_column_length, False), add_len={0: 0})
-
-            # Print the incapsulated action display
-            print((conv_log_append := f"{text_you}\n{empty_vert}\n{action_display}\n{empty_vert}\n{border.en_c_down('')}"))
+            # Delete the lines of the suggestions and the lines the user entered
+            del_last_line(loops=lines_to_delete)
+
+            # Use the pre-generated reply if a suggestion was picked, otherwise discard the speculation
+            if speculator is not None:
+                shortcut = user_input.strip()
+                if shortcut.startswith("#") and shortcut[1:].isdecimal() \
+                        and 0 < int(shortcut[1:]) <= len(suggestion_lines):
+                    user_input, speculative_response = speculator.take(int(shortcut[1:]) - 1)
+                else:
+                    speculator.cancel()
+
+            with profiler.phase("render"):
+                # Print the user input incapsulated in borders
+                print((conv_log_append := turn_display.render(user_input, "user")))
 
             # Add the user input to the conversation log
             conv_log.append(conv_log_append)
@@ -273,24 +375,32 @@ if __name__ == "__main__":
         # Create the messages with the Prompt as a basis and the conversation as the messages
         messages = [{"role": "system", "content": str(system_message)}] + conversation
         # Get the response from the API
-        response = communicate_with_ai(messages, model_name="gpt-3.5-turbo")
+        with profiler.phase("api_call"):
+            response = None
+            if speculative_response is not None:
+                try:
+                    response = speculative_response.result()
+                except Exception:  # Fall back to a normal request if the speculative one failed
+                    response = None
+            if response is None:
+                response = communicate_with_ai(messages, model_name=ai_models, hedge_delay=ai_hedge_delay,
+                                               samples=ai_samples, selector=ai_selector)
 
         # If the API answered with a response
         if ai_reply := response["choices"][0]["message"]["content"]:
-            # Set the response as the game display
-            game_display_class.set_from_string(ai_reply)
-            # Wrap the game display in vertical borders
-            game_display = border.en_wrap(game_display_class.list_string_break
-                                          (term_column_length, False), add_len={0: 0})
-
-            # Print the incapsulated game display
-            print((conv_log_append := f"{text_answer}\n{empty_vert}\n{game_display}\n{empty_vert}\n{border.en_c_down('')}"))
+            with profiler.phase("render"):
+                # Print the response incapsulated in borders
+                print((conv_log_append := turn_display.render(ai_reply, "assistant")))
 
             # Add the response to the conversation log
             conv_log.append(conv_log_append)
             # Add the response to the conversation with the API
             conversation.append({"role": "assistant", "content": ai_reply})
 
+            # Speculate on the next action while the player reads the reply
+            if speculator is not None:
+                speculator.start(messages + [{"role": "assistant", "content": ai_reply}])
+
         # If the API didn't answer with a response
         else:
             print(BColors.FAIL + BColors.BOLD + "Failed to get a response from the ChatGPT API." + BColors.ENDC)
@@ -305,6 +415,10 @@ if __name__ == "__main__":
                                    fill="═", ignore_error=True)
     # Print the exit menu bar
     print(exit_menu_bar)
+    # Print the cost of the speculative requests
+    if speculator is not None:
+        print(f"Suggestions cost {speculator.spent_tokens} tokens, "
+              f"{speculator.wasted_tokens} of them were not used.")
 
     # Exit menu loop
     while True:
@@ -317,20 +431,31 @@ if __name__ == "__main__":
                 while True:
                     user_input = input("Your choice: ")
 
+                    # Ask before replacing a different save with the same name
+                    overwrite = False
+                    if user_input != loaded_name and os.path.exists(files.save_path_binary(user_input)):
+                        print("File already exists. Do you want to overwrite it? Y/N")
+                        if input("Your choice: ") not in ["Y", "y", "J", "j"]:
+                            print("Please enter another filename.")
+                            continue
+                        overwrite = True
+
                     try:
-                        # Save the conversation and history to json files
-                        files.save_state(conversation, conv_log, user_input)
+                        # Save the conversation and history to a save container, a loaded save is extended
+                        with profiler.phase("save"):
+                            files.save_state_binary(conversation, conv_log, user_input,
+                                                    append=user_input == loaded_name, overwrite=overwrite)
 
                         # Clear the screen and print the exit menu bar with a success message
                         clear_terminal()
                         print(exit_menu_bar)
-                        print(f"Saved to {user_input}_hist.json and {user_input}_conv.json.")
+                        print(f"Saved to {user_input}.tsav.")
                         break
 
                     except FileExistsError:
                         print("File already exists.")
                         continue
-                    except json.decoder.JSONDecodeError:  # Invalid file contents
+                    except SaveFormatException:  # Invalid file contents
                         print("Invalid file.")
                         continue
 
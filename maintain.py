@@ -0,0 +1,396 @@
+# Author: DerVogel101
+# Description: Maintenance tool for the saves of the text adventure game.
+# GitHub: https://github.com/DerVogel101/TextAdventureAI
+
+import sys
+import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+import argparse
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from filecontrol import FileControl
+from game_excaptions import SaveFormatException
+from turn_display import TurnDisplay
+from BColors import BColors
+
+JOURNAL_NAME = ".maintenance.jsonl"
+PARTIAL_SUFFIX = ".partial"
+QUARANTINE_FOLDER = "quarantine"
+MIGRATED_FOLDER = "migrated"
+DUPLICATES_FOLDER = "duplicates"
+
+
+def save_files(save_path: str, name: str) -> list[str]:
+    """Returns the paths of all existing files that belong to a save.
+    :param save_path: The path to the saves.
+    :param name: The name of the save.
+    :return: The paths of the .tsav, _conv.json and _hist.json files that exist."""
+    paths = [os.path.join(save_path, name + suffix) for suffix in (".tsav", "_conv.json", "_hist.json")]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def save_signature(save_path: str, name: str) -> list:
+    """Returns the name, size and modification time of all files of a save to detect changes.
+    :param save_path: The path to the saves.
+    :param name: The name of the save.
+    :return: The signature of the save."""
+    signature = []
+    for path in save_files(save_path, name):
+        stat = os.stat(path)
+        signature.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def scan_saves(save_path: str, remove_partial: bool = True, started: float | None = None) -> list[str]:
+    """Returns the names of all saves and removes the partial files left over by an interrupted run.\n
+    Partial files are named <name>.partial.tsav, <name>.partial_conv.json or <name>.partial_hist.json,
+    the game writes the same names while it overwrites a save, so only files older than the run are removed.
+    :param save_path: The path to the saves.
+    :param remove_partial: If the partial files of an interrupted run should be removed.
+    :param started: The time.time() the run started at, partial files modified after it are kept.
+    :return: The sorted names of the saves."""
+    names = set()
+    for entry in os.scandir(save_path):
+        if not entry.is_file():
+            continue
+        for suffix in (".tsav", "_conv.json", "_hist.json"):
+            if entry.name.endswith(suffix):
+                name = entry.name[:-len(suffix)]
+                if name.endswith(PARTIAL_SUFFIX):
+                    if remove_partial and (started is None or entry.stat().st_mtime < started):
+                        os.remove(entry.path)
+                else:
+                    names.add(name)
+    return sorted(names)
+
+
+def move_to(save_path: str, folder: str, paths: list[str]):
+    """Moves files into a subfolder of the saves, a file of an earlier run with the same name is kept
+    and the moved file gets a counter before its extension instead.
+    :param save_path: The path to the saves.
+    :param folder: The name of the subfolder.
+    :param paths: The files to be moved."""
+    os.makedirs(os.path.join(save_path, folder), exist_ok=True)
+    for path in paths:
+        root, extension = os.path.splitext(os.path.basename(path))
+        target = os.path.join(save_path, folder, root + extension)
+        counter = 1
+        while os.path.exists(target):
+            target = os.path.join(save_path, folder, f"{root}.{counter}{extension}")
+            counter += 1
+        os.rename(path, target)
+
+
+def remove_partial_files(save_path: str, name: str):
+    """Removes the partial files of a save that were left behind by an interrupted or failed run.
+    :param save_path: The path to the saves.
+    :param name: The name of the save."""
+    for suffix in (".tsav", "_conv.json", "_hist.json"):
+        path = os.path.join(save_path, name + PARTIAL_SUFFIX + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_json_list(path: str) -> tuple[list | None, bool]:
+    """Loads a json list and salvages the complete elements of a truncated file.
+    :param path: The path to the json file.
+    :return: The list or None if nothing could be salvaged and if the file had to be repaired."""
+    with open(path, "r", errors="replace") as file:
+        text = file.read()
+    try:
+        loaded = json.loads(text)
+        return (loaded, False) if isinstance(loaded, list) else (None, True)
+    except json.decoder.JSONDecodeError:
+        pass
+
+    # Read the elements one by one until the point where the file was cut off
+    decoder = json.JSONDecoder()
+    position = text.find("[")
+    if position < 0:
+        return None, True
+    salvaged = []
+    position += 1
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        try:
+            element, position = decoder.raw_decode(text, position)
+        except json.decoder.JSONDecodeError:
+            break
+        salvaged.append(element)
+    return salvaged, True
+
+
+def valid_message(message) -> bool:
+    """Checks if an element of a conversation is a valid message for the API.
+    :param message: The element to be checked.
+    :return: If the message is valid."""
+    return (isinstance(message, dict) and message.get("role") in ("system", "user", "assistant")
+            and isinstance(message.get("content"), str))
+
+
+def prefix_hashes(conversation: list[dict]) -> list[str]:
+    """Returns a hash for every prefix of a conversation, equal prefixes have equal hashes.
+    :param conversation: The conversation to be hashed.
+    :return: The hash of the first message, the first two messages and so on."""
+    chain = hashlib.sha256()
+    hashes = []
+    for message in conversation:
+        chain.update(json.dumps(message, sort_keys=True, separators=(",", ":")).encode("utf-8") + b"\n")
+        hashes.append(chain.hexdigest())
+    return hashes
+
+
+def process_save(save_path: str, prompt_path: str, name: str, migrate: bool, check: bool) -> dict:
+    """Validates, repairs or quarantines, compacts and migrates a single save.\n
+    Every change is written to a partial file first and then moved over the old one,
+    so an interrupted run never leaves a half written save behind.
+    :param save_path: The path to the saves.
+    :param prompt_path: The path to the prompts.
+    :param name: The name of the save.
+    :param migrate: If a _conv.json/_hist.json pair should be converted to a save container.
+    :param check: If the save should only be checked without changing any file.
+    :return: The name, actions, notes, processed bytes, prefix hashes and the signature after processing."""
+    files = FileControl(prompt_path, save_path)
+    result = {"name": name, "actions": [], "notes": [], "hashes": [],
+              "bytes": sum(os.path.getsize(path) for path in save_files(save_path, name))}
+    tsav_path = files.save_path_binary(name)
+    conv_path = os.path.join(save_path, name + "_conv.json")
+    hist_path = os.path.join(save_path, name + "_hist.json")
+    conversation: list[dict] | None = None
+
+    # Save container
+    if os.path.exists(tsav_path):
+        try:
+            with files.load_state_binary(name) as save:
+                conversation, history = save.conversation(), save.history()
+                oversized = os.path.getsize(tsav_path) > save.compact_size()
+            if not all(valid_message(message) for message in conversation) or \
+                    not all(isinstance(message, str) for message in history):
+                raise SaveFormatException("the container has invalid records")
+        except (SaveFormatException, ValueError, IndexError) as error:
+            conversation = None
+            result["notes"].append(f"invalid container: {error}")
+            result["actions"].append("quarantined")
+            if not check:
+                move_to(save_path, QUARANTINE_FOLDER, [tsav_path])
+        else:
+            if oversized:
+                result["actions"].append("compacted")
+                if not check:
+                    remove_partial_files(save_path, name)
+                    files.save_state_binary(conversation, history, name + PARTIAL_SUFFIX)
+                    os.replace(files.save_path_binary(name + PARTIAL_SUFFIX), tsav_path)
+
+    # Legacy _conv.json/_hist.json pair
+    if os.path.exists(conv_path) or os.path.exists(hist_path):
+        repaired = False
+        try:
+            pair_conv, pair_hist = files.load_state(name)
+        except (FileNotFoundError, json.decoder.JSONDecodeError, UnicodeDecodeError):
+            pair_conv, conv_repaired = load_json_list(conv_path) if os.path.exists(conv_path) else (None, True)
+            pair_hist, hist_repaired = load_json_list(hist_path) if os.path.exists(hist_path) else (None, True)
+            repaired = conv_repaired or hist_repaired
+
+        # Files that are valid json but not a list are as unusable as unreadable ones
+        if isinstance(pair_conv, list):
+            valid_conv = [message for message in pair_conv if valid_message(message)]
+            repaired = repaired or len(valid_conv) != len(pair_conv)
+            pair_conv = valid_conv
+        elif pair_conv is not None:
+            pair_conv = None
+            repaired = True
+        if isinstance(pair_hist, list):
+            valid_hist = [message for message in pair_hist if isinstance(message, str)]
+            repaired = repaired or len(valid_hist) != len(pair_hist)
+            pair_hist = valid_hist
+        elif pair_hist is not None:
+            pair_hist = None
+            repaired = True
+
+        pair_paths = [path for path in (conv_path, hist_path) if os.path.exists(path)]
+        if conversation is not None and pair_paths == [hist_path]:
+            # A migration was interrupted after the conversation was moved, the history belongs to the container
+            result["notes"].append("history left behind by an interrupted migration")
+            result["actions"].append("archived")
+            if not check:
+                move_to(save_path, MIGRATED_FOLDER, pair_paths)
+        elif not pair_conv:
+            # Without the conversation the game can not be continued
+            result["notes"].append("conversation is missing or unreadable")
+            result["actions"].append("quarantined")
+            if not check:
+                move_to(save_path, QUARANTINE_FOLDER, pair_paths)
+        elif conversation is not None:
+            # Both formats exist, the pair is only redundant if the container already contains it
+            if prefix_hashes(pair_conv)[-1] in prefix_hashes(conversation):
+                result["actions"].append("archived")
+                if not check:
+                    move_to(save_path, MIGRATED_FOLDER, pair_paths)
+            else:
+                result["notes"].append("json pair differs from the container, left untouched")
+        else:
+            if pair_hist is None:
+                result["notes"].append("history is missing or unreadable, rendered it from the conversation")
+                pair_hist = TurnDisplay(120).render_history(pair_conv)
+            if repaired:
+                result["actions"].append("repaired")
+            conversation = pair_conv
+            if migrate:
+                result["actions"].append("migrated")
+                if not check:
+                    remove_partial_files(save_path, name)
+                    files.save_state_binary(pair_conv, pair_hist, name + PARTIAL_SUFFIX)
+                    os.replace(files.save_path_binary(name + PARTIAL_SUFFIX), tsav_path)
+                    move_to(save_path, MIGRATED_FOLDER, pair_paths)
+            elif repaired and not check:
+                remove_partial_files(save_path, name)
+                files.save_state(pair_conv, pair_hist, name + PARTIAL_SUFFIX)
+                os.replace(os.path.join(save_path, name + PARTIAL_SUFFIX + "_conv.json"), conv_path)
+                os.replace(os.path.join(save_path, name + PARTIAL_SUFFIX + "_hist.json"), hist_path)
+
+    if conversation:
+        result["hashes"] = prefix_hashes(conversation)
+    result["signature"] = save_signature(save_path, name)
+    return result
+
+
+def find_duplicates(results: dict[str, dict], include_prefixes: bool = False) -> dict[str, str]:
+    """Finds saves whose conversation is identical to another save or, if include_prefixes is set,
+    an identical prefix of a longer save.
+    :param results: The results of process_save by the name of the save.
+    :param include_prefixes: If saves that are the beginning of a longer save count as duplicates.
+    :return: The name of every duplicate and the name of the save that is kept instead."""
+    keepers: dict[str, tuple[int, str]] = {}
+    for name, result in sorted(results.items()):
+        length = len(result["hashes"])
+        prefix_hashes_to_check = result["hashes"] if include_prefixes else result["hashes"][-1:]
+        for prefix_hash in prefix_hashes_to_check:
+            # Keep the longest save for every prefix, for saves of equal length the first name
+            if prefix_hash not in keepers or length > keepers[prefix_hash][0]:
+                keepers[prefix_hash] = (length, name)
+
+    duplicates = {}
+    for name, result in results.items():
+        if result["hashes"] and (keeper := keepers[result["hashes"][-1]][1]) != name:
+            duplicates[name] = keeper
+    return duplicates
+
+
+def load_journal(journal_path: str) -> dict[str, dict]:
+    """Loads the results of earlier runs, a line cut off by an interruption is ignored.
+    :param journal_path: The path to the journal.
+    :return: The latest result by the name of the save."""
+    journal = {}
+    if os.path.exists(journal_path):
+        with open(journal_path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    continue
+                journal[entry["name"]] = entry
+    return journal
+
+
+def main(arguments: list[str] | None = None):
+    """Runs the maintenance of the saves folder.
+    :param arguments: The command line arguments, sys.argv is used if None."""
+    app_path = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Validates, repairs, migrates and deduplicates the saves.")
+    parser.add_argument("--saves", default=os.path.join(app_path, "saves"), help="The path to the saves.")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes.")
+    parser.add_argument("--check", action="store_true", help="Only report problems without changing any file.")
+    parser.add_argument("--no-migrate", action="store_true",
+                        help="Keep _conv.json/_hist.json pairs instead of converting them to .tsav.")
+    parser.add_argument("--no-dedupe", action="store_true",
+                        help="Keep saves whose conversation is identical to another save.")
+    parser.add_argument("--dedupe-prefixes", action="store_true",
+                        help="Also move saves whose conversation is the beginning of a longer save.")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the journal of earlier runs.")
+    args = parser.parse_args(arguments)
+
+    save_path = args.saves
+    prompt_path = os.path.join(app_path, "prompts")
+    journal_path = os.path.join(save_path, JOURNAL_NAME)
+    journal = {} if args.fresh else load_journal(journal_path)
+
+    names = scan_saves(save_path, remove_partial=not args.check, started=time.time())
+    results: dict[str, dict] = {}
+    pending = []
+    for name in names:
+        if not args.check and name in journal and journal[name]["signature"] == save_signature(save_path, name):
+            results[name] = journal[name]
+        else:
+            pending.append(name)
+    print(f"Found {len(names)} saves, {len(names) - len(pending)} unchanged since the last run.")
+
+    action_counts: dict[str, int] = {}
+    processed_bytes = 0
+    started = time.perf_counter()
+    journal_file = None if args.check else open(journal_path, "a")
+    executor = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        futures = {executor.submit(process_save, save_path, prompt_path, name, not args.no_migrate, args.check): name
+                   for name in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                result = future.result()
+            except Exception as error:
+                # Report the save and keep going, it is not journaled so the next run tries it again
+                action_counts["failed"] = action_counts.get("failed", 0) + 1
+                print(f"{BColors.FAIL}{futures[future]}: failed, {type(error).__name__}: {error}{BColors.ENDC}")
+                if not args.check:
+                    remove_partial_files(save_path, futures[future])
+                continue
+            results[result["name"]] = result
+            processed_bytes += result["bytes"]
+            for action in result["actions"]:
+                action_counts[action] = action_counts.get(action, 0) + 1
+            if result["actions"] or result["notes"]:
+                print(f"{BColors.WARNING}{result['name']}: {', '.join(result['actions'] + result['notes'])}"
+                      f"{BColors.ENDC}")
+            if journal_file is not None:
+                # One line per save so an interrupted run can be resumed
+                journal_file.write(json.dumps(result) + "\n")
+                journal_file.flush()
+            if done % 100 == 0:
+                print(f"{done}/{len(pending)} saves processed")
+        executor.shutdown()
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print(f"{BColors.FAIL}Interrupted, run the tool again to resume.{BColors.ENDC}")
+        return
+    finally:
+        if journal_file is not None:
+            journal_file.close()
+    elapsed = time.perf_counter() - started
+
+    # Deduplicate after all saves are known, a duplicate can belong to any other save
+    duplicates = find_duplicates(results)
+    for name, keeper in duplicates.items():
+        print(f"{name}: identical to {keeper}")
+        if not args.check and not args.no_dedupe:
+            move_to(save_path, DUPLICATES_FOLDER, save_files(save_path, name))
+            action_counts["deduplicated"] = action_counts.get("deduplicated", 0) + 1
+    # Shorter saves are often checkpoints kept on purpose, they are only moved if asked for
+    for name, keeper in find_duplicates(results, include_prefixes=True).items():
+        if name in duplicates:
+            continue
+        print(f"{name}: beginning of {keeper}")
+        if not args.check and args.dedupe_prefixes:
+            move_to(save_path, DUPLICATES_FOLDER, save_files(save_path, name))
+            action_counts["deduplicated prefixes"] = action_counts.get("deduplicated prefixes", 0) + 1
+
+    print(f"\nProcessed {len(pending)} saves ({processed_bytes / 1_000_000:.2f} MB) in {elapsed:.2f} s, "
+          f"{len(pending) / elapsed if elapsed else 0:.1f} saves/s, "
+          f"{processed_bytes / 1_000_000 / elapsed if elapsed else 0:.2f} MB/s")
+    for action, count in sorted(action_counts.items()):
+        print(f"{action}: {count}")
+
+
+if __name__ == "__main__":
+    main()